@@ -1,5 +1,10 @@
 import os
-import base64
+# The full-volume buffers (input, stitched logits) change size with every scan;
+# expandable segments let the CUDA allocator grow blocks in place instead of
+# fragmenting into "reserved >> allocated". Must be set before torch touches CUDA.
+if "PYTORCH_ALLOC_CONF" not in os.environ:
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+import binascii
 import uuid
 import numpy as np
 import torch
@@ -8,17 +13,29 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from skimage import measure
 import tempfile
+import shutil
 import traceback
+import contextlib
+import hashlib
+import threading
+import queue
+import time
+import orjson
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import dash
-from dash import dcc, html, Input, Output, State, ctx, no_update
+from dash import dcc, html, Input, Output, State, MATCH, Patch, ctx, no_update
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
+from flask import send_from_directory
+from flask.json.provider import DefaultJSONProvider
 
 from monai.inferers import sliding_window_inference
+from monai.data.utils import compute_importance_map
 from monai.transforms import (
-    LoadImage, EnsureChannelFirst, Orientation, Spacing, 
-    NormalizeIntensity, SpatialPad
+    Compose, LoadImage, EnsureChannelFirst, Orientation, Spacing, 
+    NormalizeIntensity, SpatialPad, ToDevice
 )
 from config import Config
 from model import nnFormer
@@ -27,78 +44,163 @@ from model import nnFormer
 # METRIC CALCULATION FUNCTIONS
 # =========================================
 
-def calculate_dice_score(pred, gt, label):
-    """Calculate Dice score for a specific label"""
-    pred_mask = (pred == label)
-    gt_mask = (gt == label)
-    
-    intersection = np.sum(pred_mask & gt_mask)
-    total = np.sum(pred_mask) + np.sum(gt_mask)
-    
-    if total == 0:
-        return 1.0 if intersection == 0 else 0.0
-    
-    return (2.0 * intersection) / total
+TUMOR_LABELS = (1, 2, 3)
 
-def calculate_iou(pred, gt, label):
-    """Calculate Intersection over Union for a specific label"""
-    pred_mask = (pred == label)
-    gt_mask = (gt == label)
-    
-    intersection = np.sum(pred_mask & gt_mask)
-    union = np.sum(pred_mask | gt_mask)
-    
-    if union == 0:
-        return 1.0 if intersection == 0 else 0.0
-    
-    return intersection / union
+def one_hot(mask, labels=TUMOR_LABELS):
+    """(len(labels), *mask.shape) bool stack, written in place with one compare per label"""
+    out = np.empty((len(labels),) + mask.shape, dtype=bool)
+    for i, l in enumerate(labels):
+        np.equal(mask, l, out=out[i])
+    return out
 
-def calculate_precision_recall(pred, gt, label):
-    """Calculate Precision and Recall for a specific label"""
-    pred_mask = (pred == label)
-    gt_mask = (gt == label)
-    
-    tp = np.sum(pred_mask & gt_mask)
-    fp = np.sum(pred_mask & ~gt_mask)
-    fn = np.sum(~pred_mask & gt_mask)
-    
-    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-    
-    return precision, recall
+# Voxels per block in label_counts: three bool scratch blocks of this size stay
+# cache-resident while every label is compared, ANDed and counted
+_COUNT_BLOCK = 1 << 18
 
-def calculate_sensitivity_specificity(pred, gt, label):
-    """Calculate Sensitivity and Specificity"""
-    pred_mask = (pred == label)
-    gt_mask = (gt == label)
-    
-    tp = np.sum(pred_mask & gt_mask)
-    tn = np.sum(~pred_mask & ~gt_mask)
-    fp = np.sum(pred_mask & ~gt_mask)
-    fn = np.sum(~pred_mask & gt_mask)
+def label_counts(pred, gt, labels=TUMOR_LABELS):
+    """TP, FP, FN, TN per label, from one cache-blocked pass over both volumes.
+
+    Each block is compared against every label while it is still in cache,
+    using preallocated scratch buffers, so nothing full-size is allocated.
+    (A bincount confusion matrix needs a full-size index array and is
+    several times slower.)
+    """
+    pred_flat, gt_flat = pred.ravel(), gt.ravel()
+    tp = np.zeros(len(labels), dtype=np.int64)
+    n_pred = np.zeros(len(labels), dtype=np.int64)
+    n_gt = np.zeros(len(labels), dtype=np.int64)
     
-    sensitivity = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-    specificity = tn / (tn + fp) if (tn + fp) > 0 else 0.0
+    block = max(1, min(_COUNT_BLOCK, pred_flat.size))
+    pred_buf, gt_buf, both_buf = (np.empty(block, dtype=bool) for _ in range(3))
+    for start in range(0, pred_flat.size, block):
+        pred_block, gt_block = pred_flat[start:start + block], gt_flat[start:start + block]
+        n = pred_block.size
+        pred_mask, gt_mask, both = pred_buf[:n], gt_buf[:n], both_buf[:n]
+        for i, l in enumerate(labels):
+            np.equal(pred_block, l, out=pred_mask)
+            np.equal(gt_block, l, out=gt_mask)
+            np.logical_and(pred_mask, gt_mask, out=both)
+            tp[i] += np.count_nonzero(both)
+            n_pred[i] += np.count_nonzero(pred_mask)
+            n_gt[i] += np.count_nonzero(gt_mask)
     
-    return sensitivity, specificity
+    return _counts_from_totals(labels, tp, n_pred, n_gt, pred.size)
 
-def calculate_hausdorff_distance(pred, gt, label, percentile=95):
-    """Calculate Hausdorff Distance (simplified version)"""
-    from scipy.spatial.distance import directed_hausdorff
+def label_counts_torch(pred, gt, labels=TUMOR_LABELS):
+    """label_counts for tensors, computed on their device (e.g. the GPU).
+
+    Only the 3 totals per label are copied back to the host.
+    """
+    totals = []
+    for l in labels:
+        pred_mask, gt_mask = (pred == l), (gt == l)
+        totals.append(torch.stack([(pred_mask & gt_mask).sum(), pred_mask.sum(), gt_mask.sum()]))
+    tp, n_pred, n_gt = torch.stack(totals).cpu().numpy().T
+    return _counts_from_totals(labels, tp, n_pred, n_gt, pred.numel())
+
+def _counts_from_totals(labels, tp, n_pred, n_gt, size):
+    """Per-label (TP, FP, FN, TN) from TP and the per-volume label counts"""
+    counts = {}
+    for i, l in enumerate(labels):
+        fp, fn = n_pred[i] - tp[i], n_gt[i] - tp[i]
+        counts[l] = (int(tp[i]), int(fp), int(fn), int(size - tp[i] - fp - fn))
+    return counts
+
+def _ratio(num, den, empty):
+    """num / den elementwise, with `empty` wherever den is 0"""
+    return np.divide(num, den, out=np.full_like(den, empty), where=den != 0)
+
+def label_scores(counts):
+    """Every overlap metric for all labels at once, as label -> {metric: value}.
+
+    The labels' counts are stacked into vectors, so the empty-mask cases are
+    handled by masked divides rather than a branch per label and metric.
+    """
+    labels = list(counts)
+    tp, fp, fn, tn = np.array([counts[l] for l in labels], dtype=np.float64).T
+    scores = {
+        'dice': _ratio(2 * tp, 2 * tp + fp + fn, 1.0),
+        'iou': _ratio(tp, tp + fp + fn, 1.0),
+        'precision': _ratio(tp, tp + fp, 0.0),
+        'recall': _ratio(tp, tp + fn, 0.0),
+        'specificity': _ratio(tn, tn + fp, 0.0),
+    }
+    scores['sensitivity'] = scores['recall']
+    return {l: {m: float(v[i]) for m, v in scores.items()} for i, l in enumerate(labels)}
+
+def _surface_points(vol, label, key=None):
+    """int32 coordinates of the boundary voxels of one label.
+
+    With a volume key (see array_key) the result is cached, so repeated
+    or additional surface metrics on the same volume skip the scan.
+    """
+    def compute():
+        from scipy.ndimage import binary_erosion
+        mask = (vol == label)
+        return np.argwhere(mask ^ binary_erosion(mask)).astype(np.int32)
+    return compute() if key is None else memoize_metric(("surface", key, label), compute)
+
+def _select_percentile(d, q):
+    """np.percentile(d, q) (linear interpolation) by O(n) selection; reorders d in place"""
+    pos = q / 100 * (d.size - 1)
+    lo = int(pos)
+    hi = min(lo + 1, d.size - 1)
+    d.partition((lo, hi))
+    return float(d[lo] + (d[hi] - d[lo]) * (pos - lo))
+
+def calculate_hausdorff_distance(pred, gt, label, percentile=95, pred_key=None, gt_key=None):
+    """Calculate the percentile Hausdorff Distance between label surfaces (HD95 by default)
+
+    Distances are measured between boundary voxels, as is standard for
+    surface metrics, using one KD-tree per surface queried in parallel.
+    Pass the volume keys to reuse cached surfaces.
+    """
+    from scipy.spatial import cKDTree
     
-    pred_mask = (pred == label)
-    gt_mask = (gt == label)
+    pred_points = _surface_points(pred, label, pred_key)
+    gt_points = _surface_points(gt, label, gt_key)
     
-    if np.sum(pred_mask) == 0 or np.sum(gt_mask) == 0:
+    if len(pred_points) == 0 or len(gt_points) == 0:
         return float('inf')
     
-    pred_points = np.argwhere(pred_mask)
-    gt_points = np.argwhere(gt_mask)
+    pred_tree, gt_tree = cKDTree(pred_points), cKDTree(gt_points)
+    
+    forward = gt_tree.query(pred_points, workers=-1)[0]
+    backward = pred_tree.query(gt_points, workers=-1)[0]
     
-    forward = directed_hausdorff(pred_points, gt_points)[0]
-    backward = directed_hausdorff(gt_points, pred_points)[0]
+    return max(_select_percentile(forward, percentile), _select_percentile(backward, percentile))
+
+# Recent metric results keyed by volume contents, most recently used last
+METRIC_CACHE = OrderedDict()
+METRIC_CACHE_SIZE = 256
+_CACHE_LOCK = threading.Lock()
+
+def array_key(arr):
+    """Content key for a volume (SHA-1 runs at several GB/s on SHA-NI CPUs)"""
+    return arr.shape, arr.dtype.str, hashlib.sha1(np.ascontiguousarray(arr), usedforsecurity=False).digest()
+
+def lru_memoize(cache, size, key, compute):
+    """cache[key], calling compute() only on a miss; keeps the `size` most recent entries"""
+    with _CACHE_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
     
-    return max(forward, backward)
+    result = compute()
+    lru_store(cache, size, key, result)
+    return result
+
+def lru_store(cache, size, key, value):
+    """Set cache[key] as the most recent entry, evicting the oldest beyond `size`"""
+    with _CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+def memoize_metric(key, compute):
+    """Cached result for key, calling compute() only on a miss"""
+    return lru_memoize(METRIC_CACHE, METRIC_CACHE_SIZE, key, compute)
 
 # =========================================
 # 1. SETUP & CSS
@@ -106,6 +208,24 @@ def calculate_hausdorff_distance(pred, gt, label, percentile=95):
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY, dbc.icons.FONT_AWESOME])
 server = app.server
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON through orjson.
+
+    Callback responses already go through plotly's orjson engine; this covers the
+    request side, where Flask parses each callback body (uploads arrive as multi-MB
+    base64 strings inside it). Anything orjson can't encode falls back to Flask's
+    own default hook.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+server.json_provider_class = OrjsonProvider
+server.json = OrjsonProvider(server)
+
 app.index_string = '''
 <!DOCTYPE html>
 <html>
@@ -436,20 +556,27 @@ app.index_string = '''
                 height: 300px;
             }
 
-            .btn-modern:hover:not(:disabled) {
+            .btn-modern:hover:not(:disabled):not([aria-disabled="true"]) {
                 transform: translateY(-2px);
                 box-shadow: 0 8px 24px rgba(99, 102, 241, 0.4);
             }
 
-            .btn-modern:active:not(:disabled) {
+            .btn-modern:active:not(:disabled):not([aria-disabled="true"]) {
                 transform: translateY(0);
             }
 
-            .btn-modern:disabled {
+            .btn-modern:disabled,
+            .btn-modern[aria-disabled="true"] {
                 opacity: 0.5;
                 cursor: not-allowed;
             }
 
+            a.btn-modern {
+                display: block;
+                text-align: center;
+                text-decoration: none;
+            }
+
             .btn-primary-custom {
                 background: linear-gradient(135deg, var(--primary) 0%, var(--primary-dark) 100%);
                 color: white;
@@ -461,7 +588,7 @@ app.index_string = '''
                 color: var(--text-primary);
             }
 
-            .btn-secondary-custom:hover:not(:disabled) {
+            .btn-secondary-custom:hover:not(:disabled):not([aria-disabled="true"]) {
                 background: rgba(255, 255, 255, 0.08);
                 border-color: var(--primary);
             }
@@ -743,98 +870,451 @@ app.index_string = '''
 '''
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Patches always have the same shape, so cuDNN autotuning pays off after the first one
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
 TEMP_DIR = "/mnt/data"
 
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR, exist_ok=True)
 
 MODEL = None
+_MODEL_LOCK = threading.Lock()
+
+# File reads/writes that can overlap with inference (gzip and NumPy release the GIL)
+IO_POOL = ThreadPoolExecutor(max_workers=2)
+# Result writes get their own single thread: they run in submission order, so a re-run
+# never races the earlier write of the same session, and they never hold up IO_POOL reads
+SAVE_POOL = ThreadPoolExecutor(max_workers=1)
 
 # =========================================
 # REASSEMBLY FUNCTION (SPLIT & STITCH)
 # =========================================
+def append_file(out_f, path):
+    """Append a file's bytes to out_f, copied in-kernel (sendfile) when the OS allows"""
+    with open(path, "rb") as f:
+        remaining = os.fstat(f.fileno()).st_size
+        try:
+            while remaining:
+                sent = os.sendfile(out_f.fileno(), f.fileno(), None, remaining)
+                if sent == 0:
+                    break
+                remaining -= sent
+        except (AttributeError, OSError):
+            # No sendfile for regular files here (e.g. Windows): buffered copy of the rest
+            shutil.copyfileobj(f, out_f, length=8 << 20)
+
+def file_digest(paths):
+    """SHA-256 over the concatenated contents of paths (OpenSSL uses SHA-NI where present)"""
+    digest = hashlib.sha256()
+    buf = bytearray(8 << 20)
+    view = memoryview(buf)
+    for path in paths:
+        # Unbuffered reads into one reused buffer: no per-chunk allocation or extra copy
+        with open(path, "rb", buffering=0) as f:
+            while n := f.readinto(buf):
+                digest.update(view[:n])
+    return digest.hexdigest()
+
 def reassemble_model():
-    """Stitches split model parts back into a single .pth file if needed."""
+    """Stitches split model parts back into a single .pth file if needed.
+
+    The parts' digest is recorded next to the merged file, so later starts
+    only reassemble when the parts changed or the merged file is incomplete.
+    """
     ckpt_path = os.path.join(Config.CHECKPOINT_DIR, "best.pth")
+    part_0 = ckpt_path + ".part0"
+    part_1 = ckpt_path + ".part1"
+    parts = [p for p in (part_0, part_1) if os.path.exists(p)]
     
-    # If file exists and looks big enough, skip
-    if os.path.exists(ckpt_path) and os.path.getsize(ckpt_path) > 100_000_000:
+    if not parts:
+        if not os.path.exists(ckpt_path):
+            print("⚠️ No model parts found. App may crash if inference runs.")
         return ckpt_path
+    
+    sidecar = ckpt_path + ".sha256"
+    digest = file_digest(parts)
+    if (os.path.exists(ckpt_path) and os.path.exists(sidecar)
+            and os.path.getsize(ckpt_path) == sum(os.path.getsize(p) for p in parts)):
+        with open(sidecar) as f:
+            if f.read().strip() == digest:
+                return ckpt_path
 
     print("🔧 Reassembling model from parts...")
-    part_0 = ckpt_path + ".part0"
-    part_1 = ckpt_path + ".part1"
-    
-    if os.path.exists(part_0):
-        with open(ckpt_path, "wb") as out_f:
-            # Read Part 0
-            with open(part_0, "rb") as f0: out_f.write(f0.read())
-            # Read Part 1 (if exists)
-            if os.path.exists(part_1):
-                with open(part_1, "rb") as f1: out_f.write(f1.read())
-        print("✅ Model reassembled successfully!")
-    else:
-        print("⚠️ No model parts found. App may crash if inference runs.")
+    # Write under a temporary name so an interrupted copy never passes for the checkpoint
+    tmp_path = ckpt_path + ".tmp"
+    with open(tmp_path, "wb") as out_f:
+        for part in parts:
+            append_file(out_f, part)
+    os.replace(tmp_path, ckpt_path)
+    with open(sidecar, "w") as f:
+        f.write(digest)
+    print("✅ Model reassembled successfully!")
     
     return ckpt_path
 
 def get_model():
+    """The process-wide model, loaded once; on CUDA a warm-up batch runs before it is served"""
     global MODEL
     if MODEL is None:
-        print("📥 Loading Model...")
+        # Double-checked: concurrent first requests wait for one load instead of each loading
+        with _MODEL_LOCK:
+            if MODEL is None:
+                print("📥 Loading Model...")
+                try:
+                    # Reassemble file first
+                    ckpt_path = reassemble_model()
+                    
+                    model = nnFormer(
+                        crop_size=Config.PATCH_SIZE, embedding_dim=Config.EMBEDDING_DIM,
+                        input_channels=Config.IN_CHANNELS, num_classes=Config.NUM_CLASSES,
+                        depths=Config.DEPTHS, num_heads=Config.NUM_HEADS,
+                        window_size=Config.WINDOW_SIZE, patch_size=[4, 4, 4], deep_supervision=False 
+                    )
+                    
+                    # Load weights (CPU safe): tensors are mapped from the file rather than read
+                    # and copied, and assign=True adopts them instead of copying again. On CPU they stay
+                    # backed by the page cache, so worker processes on one host share a single copy
+                    # (only tensors a later conversion rewrites, e.g. channels_last or INT8, are private)
+                    state_dict = torch.load(ckpt_path, map_location="cpu", mmap=True, weights_only=True)
+                    model.load_state_dict(state_dict, strict=False, assign=True)
+                    model = model.to(DEVICE).eval()
+                    if Config.CHANNELS_LAST:
+                        model = model.to(memory_format=torch.channels_last_3d)
+                    if DEVICE.type == "cpu" and Config.CPU_INT8:
+                        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                    if Config.COMPILE:
+                        import torch._inductor.config as inductor_config
+                        os.environ["TORCHINDUCTOR_CACHE_DIR"] = Config.COMPILE_CACHE_DIR
+                        inductor_config.fx_graph_cache = True
+                        # Patches are always PATCH_SIZE, so specialise the kernels to that shape
+                        model = torch.compile(model, mode="reduce-overhead", dynamic=False)
+                    if DEVICE.type == "cuda":
+                        warm_up(model)
+                    MODEL = model
+                    print("✅ Model Loaded.")
+                except Exception as e:
+                    print(f"❌ Error loading weights: {e}")
+                    return None
+    return MODEL
+
+# BF16 on Ampere+ (FP32's range, so no overflow in the attention logits), FP16 before that
+GPU_AUTOCAST_DTYPE = torch.bfloat16 if DEVICE.type == "cuda" and torch.cuda.is_bf16_supported() else torch.float16
+
+@contextlib.contextmanager
+def inference_context():
+    """inference_mode + autocast: BF16/FP16 on GPU, BF16 on CPUs with native support (weights stay FP32)"""
+    if DEVICE.type == "cuda":
+        autocast = torch.autocast(device_type="cuda", dtype=GPU_AUTOCAST_DTYPE)
+    else:
+        autocast = torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=Config.CPU_BF16)
+    with torch.inference_mode(), autocast:
+        yield
+
+# Patch blending weights are the same for every window and every scan: build them once
+# instead of per call (sliding_window_inference uses this whenever a full patch fits)
+ROI_WEIGHT_MAP = compute_importance_map(Config.PATCH_SIZE, mode="constant", device=DEVICE)[None, None]
+
+def to_model_layout(x):
+    """x in the memory format the model's convs run in (see Config.CHANNELS_LAST)"""
+    return x.contiguous(memory_format=torch.channels_last_3d) if Config.CHANNELS_LAST else x
+
+def run_patches(model, patches):
+    """One forward pass over a batch of patches"""
+    # Compiled graphs are specialised to full SW_BATCH_SIZE batches; a smaller one (the last
+    # batch of a volume, or any batch after an OOM back-off) runs the eager module instead
+    # of triggering another compile and CUDA graph capture for its shape
+    eager = getattr(model, "_orig_mod", model)
+    if patches.shape[0] != Config.SW_BATCH_SIZE or eager is model:
+        return eager(patches)
+    # A CUDA graph replay reuses its output buffer, and the batch's owners read their slices
+    # on their own threads while the next batch runs: hand them a copy
+    return model(patches).clone()
+
+class PatchBatcher:
+    """Runs every request's patch batches on one model thread, merging concurrent ones.
+
+    Batches arriving within `wait` seconds of each other are concatenated up to
+    `max_batch` patches and run as a single forward pass (typically the short last
+    batches of two scans). Requests never run the model concurrently, so their peak
+    memory doesn't stack and CPU inference doesn't oversubscribe the cores.
+    """
+    def __init__(self, max_batch, wait=0.01):
+        self.max_batch, self.wait = max_batch, wait
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def __call__(self, model, patches):
+        """Logits for patches, computed on the model thread"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._serve, name="patch-batcher", daemon=True)
+                self.thread.start()
+        future = Future()
+        self.queue.put((model, patches, future))
+        return future.result()
+
+    def _serve(self):
+        held = None
+        while True:
+            batch = [held or self.queue.get()]
+            held = None
+            size = len(batch[0][1])
+            deadline = time.monotonic() + self.wait
+            while size < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item[0] is not batch[0][0] or size + len(item[1]) > self.max_batch:
+                    held = item
+                    break
+                batch.append(item)
+                size += len(item[1])
+            # This is the only model thread: whatever goes wrong, fail the batch, never the loop
+            try:
+                self._run(batch)
+            except Exception as e:
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run(self, batch):
+        model = batch[0][0]
         try:
-            # Reassemble file first
-            ckpt_path = reassemble_model()
-            
-            model = nnFormer(
-                crop_size=Config.PATCH_SIZE, embedding_dim=Config.EMBEDDING_DIM,
-                input_channels=Config.IN_CHANNELS, num_classes=Config.NUM_CLASSES,
-                depths=Config.DEPTHS, num_heads=Config.NUM_HEADS,
-                window_size=Config.WINDOW_SIZE, patch_size=[4, 4, 4], deep_supervision=False 
-            ).to(DEVICE)
-            
-            # Load weights (CPU safe)
-            state_dict = torch.load(ckpt_path, map_location=DEVICE)
-            model.load_state_dict(state_dict, strict=False)
-            model.eval()
-            MODEL = model
-            print("✅ Model Loaded.")
+            patches = batch[0][1] if len(batch) == 1 else torch.cat([p for _, p, _ in batch])
+            with inference_context():
+                out = run_patches(model, to_model_layout(patches))
+            results = out.split([len(p) for _, p, _ in batch])
+            for (_, _, future), logits in zip(batch, results):
+                future.set_result(logits)
+        except torch.cuda.OutOfMemoryError as e:
+            if len(batch) > 1:
+                # Merging was ours to undo: retry each request's batch on its own
+                for item in batch:
+                    self._run([item])
+            else:
+                self._fail(batch, e)
         except Exception as e:
-            print(f"❌ Error loading weights: {e}")
-            return None
-    return MODEL
+            self._fail(batch, e)
+
+PATCH_BATCHER = PatchBatcher(max_batch=Config.SW_BATCH_SIZE)
+
+def sliding_window(model, x):
+    """Sliding-window logits for x, halving the patch batch if the GPU runs out of memory"""
+    sw_batch_size = Config.SW_BATCH_SIZE
+    # Patches are gathered into a fresh NCDHW batch each step and handed to the shared
+    # model thread, which may run them together with another request's
+    predictor = lambda patches: PATCH_BATCHER(model, patches)
+    while True:
+        try:
+            return sliding_window_inference(x, Config.PATCH_SIZE, sw_batch_size, predictor,
+                                            overlap=Config.INFERENCE_OVERLAP, roi_weight_map=ROI_WEIGHT_MAP)
+        except torch.cuda.OutOfMemoryError:
+            if sw_batch_size == Config.SW_BATCH_SIZE:
+                # Once per scan, on the first failure: shows whether it is fragmentation
+                # (reserved >> allocated) or a genuinely too-large batch
+                print(torch.cuda.memory_summary(abbreviated=True))
+            if sw_batch_size == 1:
+                raise
+            sw_batch_size //= 2
+            print(f"⚠️ Out of GPU memory, retrying with {sw_batch_size} patches per batch.")
+
+def warm_up(model):
+    """Push dummy batches through so cuDNN autotuning and torch.compile happen before the first request"""
+    dummy = torch.zeros(Config.SW_BATCH_SIZE, Config.IN_CHANNELS, *Config.PATCH_SIZE, device=DEVICE)
+    # Twice: under reduce-overhead the first call compiles and the second records the CUDA graph.
+    # Through the batcher, because CUDA graph trees are per thread: the graph has to be
+    # recorded on the thread that replays it for requests.
+    for _ in range(2):
+        PATCH_BATCHER(model, dummy)
+
+# Load (and warm) the model in the background while the server boots instead of on the
+# first request; a request that arrives mid-load waits on _MODEL_LOCK for the same load
+if Config.WARM_START:
+    threading.Thread(target=get_model, name="model-preload", daemon=True).start()
+
+# Built once at import instead of re-creating every transform per request.
+# lazy=True folds Orientation + Spacing into a single resample (one composed affine,
+# one grid_sample pass); on GPU the volume moves to the device right after loading
+# so the resample runs there.
+PIPELINE = Compose([LoadImage(image_only=True), EnsureChannelFirst(),
+                    *([ToDevice(device=DEVICE)] if DEVICE.type == "cuda" else []), Orientation(axcodes="RAS"),
+                    Spacing(pixdim=[1,1,1], mode="bilinear"), NormalizeIntensity(nonzero=True, channel_wise=True),
+                    SpatialPad(spatial_size=Config.PATCH_SIZE)], lazy=True)
 
 def preprocess(path):
-    t = [LoadImage(image_only=True), EnsureChannelFirst(), Orientation(axcodes="RAS"),
-         Spacing(pixdim=[1,1,1], mode="bilinear"), NormalizeIntensity(nonzero=True, channel_wise=True),
-         SpatialPad(spatial_size=Config.PATCH_SIZE)]
-    data = t[0](path)
-    for tr in t[1:]: data = tr(data)
+    """Load, resample and normalise a scan into a (1, C, D, H, W) tensor on DEVICE.
+
+    Also returns the 4x4 affine of the resampled, padded grid (the one the
+    predicted mask lives on), so callers don't need to re-read the NIfTI header.
+
+    The shape varies per scan (padding only raises each side to PATCH_SIZE) and
+    requests run on concurrent server threads, so every call gets its own tensor
+    rather than a shared preallocated buffer.
+    """
+    data = PIPELINE(path)
+    affine = np.asarray(data.affine.cpu(), dtype=np.float64)
+    
+    data = data.unsqueeze(0).to(DEVICE)
     
     # --- FIX: HANDLE SINGLE CHANNEL INPUTS ---
-    # If the image has only 1 channel (Shape: [1, D, H, W]), 
-    # we repeat it 4 times to match the model's expected input (Shape: [4, D, H, W]).
-    if data.shape[0] == 1:
+    # If the image has only 1 channel (Shape: [1, 1, D, H, W]), we present it 4 times to
+    # match the model's expected input (Shape: [1, 4, D, H, W]). expand is a stride-0 view,
+    # so only the one channel is copied to the device; windows are copied per patch anyway.
+    if data.shape[1] == 1:
         print("⚠️ Single channel input detected. Repeating data to fake 4 channels.")
-        data = data.repeat(4, 1, 1, 1)
+        data = data.expand(-1, Config.IN_CHANNELS, -1, -1, -1)
     # ----------------------------------------
-    
-    return data.unsqueeze(0).to(DEVICE)
-
-def make_mesh(mask, label_id, color, name, opacity=0.3):
-    binary = (mask > 0) if label_id == 'brain' else (mask == label_id)
-    step = 4 if label_id == 'brain' else 2
-    if np.sum(binary) < 100: return None
+    return data, affine
+
+def load_ground_truth(path):
+    """Ground-truth label volume as uint8 (first volume of a 4D file)"""
+    # Read through dataobj in the stored dtype: get_fdata would expand the labels to float64
+    gt_nifti = nib.load(path)
+    gt = gt_nifti.dataobj[:,:,:,0] if len(gt_nifti.shape) == 4 else gt_nifti.dataobj
+    return np.ascontiguousarray(np.asarray(gt), dtype=np.uint8)
+
+# Pending result writes per session folder; entries are dropped once written
+SAVE_FUTURES = {}
+_SAVE_LOCK = threading.Lock()
+
+def save_results(path, orig, mask, affine):
+    """Write a session's outputs: img/mask .npy for the 2D views, pred.nii.gz for download"""
+    # img.npy only re-renders the 8-bit views after a cache miss, so half precision is
+    # plenty (within one gray level) and halves the write and the reload
+    np.save(os.path.join(path, "img.npy"), orig.astype(np.float16))
+    np.save(os.path.join(path, "mask.npy"), mask)
+    nib.save(nib.Nifti1Image(mask, affine), os.path.join(path, "pred.nii.gz"))
+
+def submit_results(path, orig, mask, affine):
+    """Write the session's outputs in the background (gzip is the slow part)"""
+    session_id = os.path.basename(path)
+    with _SAVE_LOCK:
+        future = SAVE_POOL.submit(save_results, path, orig, mask, affine)
+        SAVE_FUTURES[session_id] = future
+
+    def forget(done):
+        with _SAVE_LOCK:
+            if SAVE_FUTURES.get(session_id) is done:
+                del SAVE_FUTURES[session_id]
+    future.add_done_callback(forget)
+
+def wait_for_results(path):
+    """Block until the session's files from the last diagnosis are on disk"""
+    future = SAVE_FUTURES.get(os.path.basename(path))
+    if future is not None:
+        future.result()
+
+def histogram_bars(values, bins, **kwargs):
+    """Server-side go.Histogram equivalent: a go.Bar of `bins` equal-width bins over values"""
+    if values.size == 0:
+        return go.Bar(x=[], y=[], **kwargs)
+    counts, edges = np.histogram(values, bins=bins)
+    return go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), **kwargs)
+
+# Max triangles per mesh sent to the browser; larger meshes stall WebGL rendering.
+# Meshes are thinned by sampling the volume coarser (step / max-pool) rather than by
+# decimating afterwards, which would mean running marching cubes at full detail first.
+MESH_FACE_BUDGET = int(os.environ.get("MESH_FACE_BUDGET", 50_000))
+
+def _max_pool(binary, factor):
+    """Boolean max-pool by `factor` per axis (partial edge blocks included).
+
+    ORs the factor³ strided sub-grids into the small output, so no full-size
+    temporaries are made.
+    """
+    out = np.zeros([-(-n // factor) for n in binary.shape], dtype=bool)
+    for i in range(factor):
+        for j in range(factor):
+            for k in range(factor):
+                part = binary[i::factor, j::factor, k::factor]
+                out[:part.shape[0], :part.shape[1], :part.shape[2]] |= part
+    return out
+
+def _cropped_marching_cubes(binary, step):
+    """marching_cubes over just the region's bounding box, in full-volume coordinates.
+
+    The box is widened to start on the step grid and to keep one empty sample
+    on each side, so the result matches running on the whole volume.
+    """
+    lo, hi = [], []
+    for axis in range(3):
+        nz = np.flatnonzero(binary.any(axis=tuple(a for a in range(3) if a != axis)))
+        start = max(0, nz[0] - 1) // step * step
+        stop = min(binary.shape[axis], start + -(-(nz[-1] + 1 - start) // step) * step + 1)
+        lo.append(start)
+        hi.append(stop)
+    verts, faces, normals, values = measure.marching_cubes(
+        binary[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], step_size=step, allow_degenerate=False)
+    return verts + np.array(lo, dtype=verts.dtype), faces, normals, values
+
+# Recent mesh geometry keyed by volume contents; both 3D views and re-runs reuse it
+MESH_CACHE = OrderedDict()
+MESH_CACHE_SIZE = 32
+
+def make_mesh(mask, label_id, color, name, opacity=0.3, key=None):
+    """Mesh3d trace for one region; pass the volume key (see array_key) to cache the geometry"""
+    def compute():
+        # A boolean mask is taken as the precomputed region itself
+        if mask.dtype == bool: binary = mask
+        else: binary = (mask > 0) if label_id == 'brain' else (mask == label_id)
+        step = 4 if label_id == 'brain' else 2
+        if np.count_nonzero(binary) < 100: return None
+        scale = 1
+        if label_id == 'brain':
+            # The shell is drawn coarse anyway: max-pool by the step first, so marching
+            # cubes (which casts its input to float32) sees 64x fewer voxels
+            binary, scale, step = _max_pool(binary, step), step, 1
+        verts, faces, _, _ = _cropped_marching_cubes(binary, step)
+        if len(faces) > MESH_FACE_BUDGET:
+            # Face count falls with step², so one coarser pass lands within budget
+            step = int(np.ceil(step * np.sqrt(len(faces) / MESH_FACE_BUDGET)))
+            verts, faces, _, _ = _cropped_marching_cubes(binary, step)
+        if scale > 1:
+            verts = verts * scale + (scale - 1) / 2  # Pooled cell -> centre of its block
+        # Plotly ships numpy arrays as base64 typed arrays: keep them float32 / int32, and
+        # one contiguous row per coordinate so each encodes without a strided gather
+        return (np.ascontiguousarray(verts.T, dtype=np.float32),
+                np.ascontiguousarray(faces.T, dtype=np.int32))
     try:
-        verts, faces, _, _ = measure.marching_cubes(binary, step_size=step)
-        return go.Mesh3d(x=verts[:,0], y=verts[:,1], z=verts[:,2], i=faces[:,0], j=faces[:,1], k=faces[:,2],
+        geometry = compute() if key is None else lru_memoize(MESH_CACHE, MESH_CACHE_SIZE, (key, label_id), compute)
+        if geometry is None: return None
+        (x, y, z), (i, j, k) = geometry
+        return go.Mesh3d(x=x, y=y, z=z, i=i, j=j, k=k,
                          opacity=opacity, color=color, name=name, showlegend=True, 
-                         hovertemplate='<b>%{text}</b><extra></extra>', text=[name]*len(verts))
+                         hovertemplate=f'<b>{name}</b><extra></extra>')
     except: return None
 
+# Base64 characters decoded per step; a multiple of 4, so every chunk decodes on its own
+UPLOAD_CHUNK = 4 << 20
+
+def save_upload(contents, path):
+    """Decode a dcc.Upload data URI into a file chunk by chunk (no full-size bytes copy)"""
+    start = contents.index(',') + 1
+    with open(path, "wb") as f:
+        for i in range(start, len(contents), UPLOAD_CHUNK):
+            f.write(binascii.a2b_base64(contents[i:i + UPLOAD_CHUNK]))
+
 # =========================================
 # 2. LAYOUT
 # =========================================
+# The 2D views keep this layout for good; slider callbacks only swap the image trace
+SLICE_FIGURE = go.Figure(layout=dict(
+    margin=dict(l=0, r=0, b=0, t=0), 
+    xaxis=dict(visible=False), 
+    yaxis=dict(visible=False), 
+    paper_bgcolor='rgba(0,0,0,0)', 
+    plot_bgcolor='rgba(0,0,0,0)',
+    hovermode=False
+))
+
 def metric_card(title, id_suffix, icon):
     return html.Div([
         html.Div([
@@ -934,11 +1414,13 @@ app.layout = html.Div([
 
                     # EXPORT SECTION
                     html.Div("3. Export", className="section-header"),
-                    html.Button([
+                    # A plain link to the download route: the file streams straight from disk
+                    # (no base64 round trip through a callback); no href until there is a result
+                    html.A([
                         html.I(className="fas fa-download", style={"marginRight": "8px"}),
                         "Download Mask"
-                    ], id="btn-dl", className="btn-modern btn-secondary-custom mb-3", disabled=True),
-                    dcc.Download(id="dl-nifti"),
+                    ], id="dl-link", className="btn-modern btn-secondary-custom mb-3", role="button",
+                       **{"aria-disabled": "true"}),
                     
                     # METRICS SUMMARY
                     html.Div("4. Metrics", className="section-header"),
@@ -1030,17 +1512,18 @@ app.layout = html.Div([
                                         html.Div([
                                             html.Div([
                                                 html.Span("Axial View"),
-                                                html.Span(id="slice-indicator-axial", 
+                                                html.Span(id={"type": "slice-indicator", "axis": "axial"}, 
                                                          style={"fontSize": "0.7rem", "color": "var(--accent)", "fontWeight": "600"})
                                             ], className="graph-header"),
-                                            dcc.Graph(id="2d-axial", 
+                                            dcc.Graph(id={"type": "slice-view", "axis": "axial"}, figure=SLICE_FIGURE,
                                                      style={"height": "350px"},
                                                      config={'displayModeBar': False}),
                                             html.Div([
+                                                # Sliders only report on release: a drag is one slice render, not one per tick
                                                 dcc.Slider(
-                                                    id="slice-slider-axial", 
+                                                    id={"type": "slice-slider", "axis": "axial"}, 
                                                     min=0, max=100, step=1, value=50, 
-                                                    marks=None,
+                                                    marks=None, updatemode="mouseup",
                                                     tooltip={"placement": "bottom", "always_visible": False},
                                                     className="custom-slider"
                                                 )
@@ -1053,17 +1536,17 @@ app.layout = html.Div([
                                         html.Div([
                                             html.Div([
                                                 html.Span("Sagittal View"),
-                                                html.Span(id="slice-indicator-sagittal", 
+                                                html.Span(id={"type": "slice-indicator", "axis": "sagittal"}, 
                                                          style={"fontSize": "0.7rem", "color": "var(--accent)", "fontWeight": "600"})
                                             ], className="graph-header"),
-                                            dcc.Graph(id="2d-sagittal", 
+                                            dcc.Graph(id={"type": "slice-view", "axis": "sagittal"}, figure=SLICE_FIGURE,
                                                      style={"height": "350px"},
                                                      config={'displayModeBar': False}),
                                             html.Div([
                                                 dcc.Slider(
-                                                    id="slice-slider-sagittal", 
+                                                    id={"type": "slice-slider", "axis": "sagittal"}, 
                                                     min=0, max=100, step=1, value=50, 
-                                                    marks=None,
+                                                    marks=None, updatemode="mouseup",
                                                     tooltip={"placement": "bottom", "always_visible": False},
                                                     className="custom-slider"
                                                 )
@@ -1076,17 +1559,17 @@ app.layout = html.Div([
                                         html.Div([
                                             html.Div([
                                                 html.Span("Coronal View"),
-                                                html.Span(id="slice-indicator-coronal", 
+                                                html.Span(id={"type": "slice-indicator", "axis": "coronal"}, 
                                                          style={"fontSize": "0.7rem", "color": "var(--accent)", "fontWeight": "600"})
                                             ], className="graph-header"),
-                                            dcc.Graph(id="2d-coronal", 
+                                            dcc.Graph(id={"type": "slice-view", "axis": "coronal"}, figure=SLICE_FIGURE,
                                                      style={"height": "350px"},
                                                      config={'displayModeBar': False}),
                                             html.Div([
                                                 dcc.Slider(
-                                                    id="slice-slider-coronal", 
+                                                    id={"type": "slice-slider", "axis": "coronal"}, 
                                                     min=0, max=100, step=1, value=50, 
-                                                    marks=None,
+                                                    marks=None, updatemode="mouseup",
                                                     tooltip={"placement": "bottom", "always_visible": False},
                                                     className="custom-slider"
                                                 )
@@ -1219,12 +1702,8 @@ def upload_file(contents, filename):
         session_path = os.path.join(TEMP_DIR, sid)
         os.makedirs(session_path, exist_ok=True)
         
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        
         file_path = os.path.join(session_path, "in.nii.gz")
-        with open(file_path, "wb") as f:
-            f.write(decoded)
+        save_upload(contents, file_path)
         
         success_msg = html.Div([
             html.I(className="fas fa-check-circle", style={"marginRight": "8px"}),
@@ -1270,12 +1749,8 @@ def upload_ground_truth(contents, filename, session_path):
             ], className="status-message status-warning", style={"padding": "8px 12px", "fontSize": "0.75rem"})
             return None, error_msg, "Not Loaded", "gt-badge gt-badge-inactive float-end"
         
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        
         gt_path = os.path.join(session_path, "gt.nii.gz")
-        with open(gt_path, "wb") as f:
-            f.write(decoded)
+        save_upload(contents, gt_path)
         
         success_msg = html.Div([
             html.I(className="fas fa-check-circle", style={"marginRight": "6px", "fontSize": "0.7rem"}),
@@ -1344,11 +1819,13 @@ def start_timer(n):
      Output("intensity-histogram", "figure"),
      Output("volume-pie", "figure"),
      Output("stats-table", "children"),
-     Output("slice-slider-axial", "max"),
-     Output("slice-slider-sagittal", "max"),
-     Output("slice-slider-coronal", "max"),
+     Output({"type": "slice-slider", "axis": "axial"}, "max"),
+     Output({"type": "slice-slider", "axis": "sagittal"}, "max"),
+     Output({"type": "slice-slider", "axis": "coronal"}, "max"),
+     Output({"type": "slice-slider", "axis": "axial"}, "value"),
+     Output({"type": "slice-slider", "axis": "sagittal"}, "value"),
+     Output({"type": "slice-slider", "axis": "coronal"}, "value"),
      Output("results", "data"),
-     Output("btn-dl", "disabled"), 
      Output("progress-bar-inner", "style", allow_duplicate=True),
      Output("progress-interval", "disabled", allow_duplicate=True),
      Output("upload-status", "children", allow_duplicate=True),
@@ -1372,28 +1849,46 @@ def diagnose(n, path, gt_path):
         if not model:
             raise Exception("Model failed to load")
 
+        # Read the ground truth (if any) on the side while the scan is segmented
+        gt_file = os.path.join(gt_path, "gt.nii.gz") if gt_path else None
+        gt_future = IO_POOL.submit(load_ground_truth, gt_file) if gt_file and os.path.exists(gt_file) else None
+        
         fpath = os.path.join(path, "in.nii.gz")
-        input_tensor = preprocess(fpath)
+        input_tensor, affine = preprocess(fpath)
         
-        with torch.no_grad():
-            output = sliding_window_inference(input_tensor, Config.PATCH_SIZE, Config.SW_BATCH_SIZE, model, overlap=0.5)
+        with inference_context():
+            output = sliding_window(model, input_tensor)
         
-        mask = torch.argmax(output, dim=1).cpu().numpy()[0]
+        # The stitched logits are float32 even under autocast (sliding_window_inference
+        # accumulates in the input's dtype), so argmax ties don't depend on BF16 rounding.
+        # Labels fit in a byte: narrow on the device, so the copy back and every mask pass
+        # below move 8x less data than int64
+        mask_t = torch.argmax(output, dim=1)[0].to(torch.uint8)
+        mask = mask_t.cpu().numpy()
         
         # --- FIX 2: Use resampled input for visualization ---
         orig = input_tensor[0, 0, :, :, :].cpu().numpy()
-        orig_header = nib.load(fpath)
         # ----------------------------------------------------
+        # The 4-channel logits (and on GPU the input) aren't needed past this point; release
+        # them now instead of holding them through the meshing and metrics below
+        del output, input_tensor
         
-        np.save(os.path.join(path, "img.npy"), orig)
-        np.save(os.path.join(path, "mask.npy"), mask)
-        nib.save(nib.Nifti1Image(mask.astype(np.uint8), orig_header.affine), os.path.join(path, "pred.nii.gz"))
+        # Written in the background (gzip is the slow part); readers wait via wait_for_results
+        submit_results(path, orig, mask, affine)
+        # Render the 2D views once now; slider callbacks then only slice this volume
+        lru_store(DATA_CACHE, DATA_CACHE_SIZE, os.path.basename(path), render_volume(orig, mask))
         
         # Calculate volumes
         voxel_volume = 0.001
-        vc = round(np.sum(mask == 1) * voxel_volume, 2)
-        ve = round(np.sum(mask == 2) * voxel_volume, 2)
-        ven = round(np.sum(mask == 3) * voxel_volume, 2)
+        # Compare each label once; volumes, meshes and histograms all reuse these masks
+        label_masks = dict(zip(TUMOR_LABELS, one_hot(mask)))
+        # Voxels per label, counted once off the bool masks (a byte-popcount pass each)
+        label_voxels = {l: np.count_nonzero(m) for l, m in label_masks.items()}
+        # Brain tissue threshold, shared by the context mesh and the intensity histogram
+        brain_mask = orig > 0.1
+        vc = round(label_voxels[1] * voxel_volume, 2)
+        ve = round(label_voxels[2] * voxel_volume, 2)
+        ven = round(label_voxels[3] * voxel_volume, 2)
         vt = round(vc + ve + ven, 2)
         
         colors = {1: '#ef4444', 2: '#3b82f6', 3: '#fbbf24'}
@@ -1408,16 +1903,18 @@ def diagnose(n, path, gt_path):
         
         # 3D Context
         fig_ctx = go.Figure(layout=layout_3d)
-        brain_mesh = make_mesh(np.where(orig > 0.1, 1, 0), 'brain', '#6b7280', 'Brain', 0.06)
+        # Geometry is cached per volume: the tumor view and re-runs reuse the context meshes
+        mask_key = array_key(mask)
+        brain_mesh = make_mesh(brain_mask, 'brain', '#6b7280', 'Brain', 0.06, key=array_key(orig))
         if brain_mesh: fig_ctx.add_trace(brain_mesh)
         for label_id, name in [(1, 'Necrotic Core'), (2, 'Edema'), (3, 'Enhancing')]:
-            mesh = make_mesh(mask, label_id, colors[label_id], name, 0.4)
+            mesh = make_mesh(label_masks[label_id], label_id, colors[label_id], name, 0.4, key=mask_key)
             if mesh: fig_ctx.add_trace(mesh)
         
         # 3D Tumor
         fig_tum = go.Figure(layout=layout_3d)
         for label_id, name in [(1, 'Necrotic Core'), (2, 'Edema'), (3, 'Enhancing')]:
-            mesh = make_mesh(mask, label_id, colors[label_id], name, 0.5)
+            mesh = make_mesh(label_masks[label_id], label_id, colors[label_id], name, 0.5, key=mask_key)
             if mesh: fig_tum.add_trace(mesh)
         
         # Radar chart
@@ -1433,15 +1930,14 @@ def diagnose(n, path, gt_path):
         )
         
         # Histogram
-        brain_mask = orig > 0.1
-        brain_intensities = orig[brain_mask].flatten()
+        # Binned here rather than in the browser: each trace ships its bin counts, not every voxel
+        brain_intensities = orig[brain_mask]
         fig_hist = go.Figure()
-        fig_hist.add_trace(go.Histogram(x=brain_intensities, nbinsx=100, marker=dict(color='#6366f1', line=dict(color='#818cf8', width=0.5)), 
-                                        name='Brain Tissue', opacity=0.75))
+        fig_hist.add_trace(histogram_bars(brain_intensities, 100, marker=dict(color='#6366f1', line=dict(color='#818cf8', width=0.5)), 
+                                          name='Brain Tissue', opacity=0.75))
         for label_id, color, name in [(1, '#ef4444', 'Necrotic'), (2, '#3b82f6', 'Edema'), (3, '#fbbf24', 'Enhancing')]:
-            region_mask = mask == label_id
-            if np.sum(region_mask) > 0:
-                fig_hist.add_trace(go.Histogram(x=orig[region_mask].flatten(), nbinsx=50, marker=dict(color=color, opacity=0.5), name=name))
+            if label_voxels[label_id] > 0:
+                fig_hist.add_trace(histogram_bars(orig[label_masks[label_id]], 50, marker=dict(color=color, opacity=0.5), name=name))
         fig_hist.update_layout(
             barmode='overlay', xaxis=dict(title='Intensity', color='white', gridcolor='rgba(255,255,255,0.1)'),
             yaxis=dict(title='Frequency', color='white', gridcolor='rgba(255,255,255,0.1)'),
@@ -1482,16 +1978,14 @@ def diagnose(n, path, gt_path):
         
         # CHECK FOR GROUND TRUTH
         gt_tab_content = empty_gt_tab
-        if gt_path and os.path.exists(os.path.join(gt_path, "gt.nii.gz")):
+        if gt_future is not None:
             try:
                 # --- FIX: Ensure GT matches resampled shape ---
                 # We don't just load the file, we should technically resample it too
                 # For simplicity, we just load it and resize if needed (or assume user uploaded matching GT)
                 # In a real app, you'd run 'preprocess' on GT too, but use Nearest Neighbor interpolation
                 
-                gt_nifti = nib.load(os.path.join(gt_path, "gt.nii.gz"))
-                gt = gt_nifti.get_fdata().astype(np.int32)
-                if len(gt.shape) == 4: gt = gt[:,:,:,0]
+                gt = gt_future.result()
                 
                 # Simple check - if shapes don't match, we can't compute metrics easily without resampling GT
                 if gt.shape != mask.shape:
@@ -1501,17 +1995,18 @@ def diagnose(n, path, gt_path):
                     raise ValueError(f"Ground truth shape {gt.shape} doesn't match resampled prediction {mask.shape}")
                 
                 # Calculate metrics
-                dice_scores = {1: calculate_dice_score(mask, gt, 1), 2: calculate_dice_score(mask, gt, 2), 3: calculate_dice_score(mask, gt, 3)}
-                iou_scores = {1: calculate_iou(mask, gt, 1), 2: calculate_iou(mask, gt, 2), 3: calculate_iou(mask, gt, 3)}
+                # Count once (on the GPU when available); every metric below is read off these counts.
+                # Re-running the same scan against the same GT reuses the stored counts.
+                pair_key = (mask_key, array_key(gt))
+                if DEVICE.type == "cuda":
+                    counts = memoize_metric(("counts",) + pair_key, lambda: label_counts_torch(mask_t, torch.as_tensor(gt, device=DEVICE)))
+                else:
+                    counts = memoize_metric(("counts",) + pair_key, lambda: label_counts(mask, gt))
+                scores = label_scores(counts)
                 
                 metrics_data = []
                 for label_id, name in [(1, 'Necrotic Core'), (2, 'Edema'), (3, 'Enhancing')]:
-                    precision, recall = calculate_precision_recall(mask, gt, label_id)
-                    sensitivity, specificity = calculate_sensitivity_specificity(mask, gt, label_id)
-                    metrics_data.append({
-                        'name': name, 'dice': dice_scores[label_id], 'iou': iou_scores[label_id],
-                        'precision': precision, 'recall': recall, 'sensitivity': sensitivity, 'specificity': specificity
-                    })
+                    metrics_data.append({'name': name, **scores[label_id]})
                 
                 # Metrics bar chart
                 fig_metrics = go.Figure()
@@ -1616,7 +2111,11 @@ def diagnose(n, path, gt_path):
         ], className="status-message status-success")
         
         return (f"{vt:.2f}", f"{vc:.2f}", f"{ve:.2f}", f"{ven:.2f}", fig_ctx, fig_tum, fig_radar, fig_hist, fig_pie, stats_table,
-                orig.shape[2] - 1, orig.shape[0] - 1, orig.shape[1] - 1, path, False, {"width": "100%"}, True, success_msg, gt_tab_content)
+                orig.shape[2] - 1, orig.shape[0] - 1, orig.shape[1] - 1,
+                # Centre each slider: the slice callbacks then fill the 2D views at once from
+                # the volume rendered above, instead of staying blank until the first drag
+                orig.shape[2] // 2, orig.shape[0] // 2, orig.shape[1] // 2,
+                path, {"width": "100%"}, True, success_msg, gt_tab_content)
         
     except Exception as e:
         print(f"❌ DIAGNOSIS ERROR: {e}")
@@ -1629,116 +2128,132 @@ def diagnose(n, path, gt_path):
                              className="status-message status-error")
         
         return ("Error", "Error", "Error", "Error", empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_table,
-                100, 100, 100, None, True, {"width": "0%"}, True, error_msg, empty_gt_tab)
+                100, 100, 100, no_update, no_update, no_update, None, {"width": "0%"}, True, error_msg, empty_gt_tab)
 
 
 # Global Cache to store loaded brains in RAM
 # Format: { 'session_id': { 'img': numpy_array, 'mask': numpy_array } }
-DATA_CACHE = {}
+# Rendered 2D view volumes (~13 MB each) for the most recently used sessions
+DATA_CACHE = OrderedDict()
+DATA_CACHE_SIZE = 8
 
-def get_slice_fig(path, dim, idx):
+# Overlay color per label: Red (1), Blue (2), Yellow (3); background is never blended
+OVERLAY_LUT = np.array([[0, 0, 0], [239, 68, 68], [59, 130, 246], [251, 191, 36]], dtype=np.float64)
+
+def render_volume(img, mask):
+    """Colorized uint8 RGB volume for the 2D views, so slider ticks only slice it.
+
+    One intensity window for every slice and view: the 0.5-99.5th percentiles
+    of the brain (non-zero) voxels, which also keeps the z-scored negatives
+    from wrapping around in the uint8 cast; the background stays black.
+    Labelled voxels are blended 60% label color + 40% original pixel.
+
+    The result is laid out axial-major, (Z, X, Y, 3): the axial view, the one
+    users scroll most, is then a single contiguous block per slider tick.
+    """
+    brain = img != 0
+    lo, hi = np.percentile(img[brain], (0.5, 99.5)) if brain.any() else (0.0, 1.0)
+    # Reordered while windowing: the transposed view is read once into a C-ordered buffer
+    img, mask = img.transpose(2, 0, 1), np.ascontiguousarray(mask.transpose(2, 0, 1))
+    brain = brain.transpose(2, 0, 1)
+    # Window in one float32 buffer, updated in place (no float64 or per-step temporaries)
+    gray = np.subtract(img, lo, dtype=np.float32, order='C')
+    gray *= np.float32(255 / max(hi - lo, 1e-6))
+    np.clip(gray, 0, 255, out=gray)
+    gray *= brain
+    # RGB only: the views are opaque, so an alpha channel would just add a constant 25%
+    # to the cache and to every slice sent to the browser
+    rgb = np.empty(img.shape + (3,), dtype=np.uint8)
+    gray_u8 = gray.astype(np.uint8)
+    for ch in range(3):
+        rgb[..., ch] = gray_u8
+    # Only the labelled voxels are blended, so no full-size float RGB temporary is made
+    active = np.flatnonzero(mask)
+    rgb.reshape(-1, 3)[active] = gray.ravel()[active][:, None] * 0.4 + OVERLAY_LUT[mask.ravel()[active]] * 0.6
+    return rgb
+
+def get_slice(path, dim, idx):
     """
-    Optimized function to get a slice from RAM if available, 
-    otherwise load from disk and cache it.
+    Optimized function to get an RGB slice from RAM if available, 
+    otherwise load from disk and cache it. None if there is nothing to show.
     """
     if not path: 
-        return go.Figure(layout=dict(paper_bgcolor="rgba(0,0,0,0)", xaxis=dict(visible=False), yaxis=dict(visible=False)))
+        return None
 
     try:
         # 1. Use folder name as Session ID
         session_id = os.path.basename(path)
 
-        # 2. Check Cache (RAM) first
-        if session_id in DATA_CACHE:
-            img = DATA_CACHE[session_id]['img']
-            mask = DATA_CACHE[session_id]['mask']
-        else:
-            # 3. Cache Miss: Load from Disk (Slow, occurs once)
+        # 2. Check Cache (RAM) first, 3. else render from disk once (diagnose normally fills it).
+        # The arrays are memory-mapped: rendering reads them once, no private copy is kept.
+        img_path = os.path.join(path, "img.npy")
+        mask_path = os.path.join(path, "mask.npy")
+        if session_id not in DATA_CACHE:
+            wait_for_results(path)
+        if session_id not in DATA_CACHE and not os.path.exists(img_path):
+            return None
+        
+        def load():
             print(f"⚡ Loading scan into RAM for {session_id}...")
-            img_path = os.path.join(path, "img.npy")
-            mask_path = os.path.join(path, "mask.npy")
-            
-            if not os.path.exists(img_path):
-                return go.Figure()
+            return render_volume(np.load(img_path, mmap_mode='r'), np.load(mask_path, mmap_mode='r'))
+        rgb = lru_memoize(DATA_CACHE, DATA_CACHE_SIZE, session_id, load)
 
-            # Load fully into RAM (remove mmap_mode)
-            img = np.load(img_path)
-            mask = np.load(mask_path)
-            
-            # Store in Cache
-            DATA_CACHE[session_id] = { 'img': img, 'mask': mask }
-
-        # 4. Slice the 3D array based on dimension
-        # dim 0 = Sagittal, dim 1 = Coronal, dim 2 = Axial
+        # 4. Slice the pre-rendered volume based on dimension
+        # dim 0 = Sagittal, dim 1 = Coronal, dim 2 = Axial; the volume is stored (Z, X, Y)
         if dim == 0: # Sagittal
-            img_slice = img[idx, :, :]
-            mask_slice = mask[idx, :, :]
+            rgb_slice = rgb[:, idx, :].swapaxes(0, 1)
         elif dim == 1: # Coronal
-            img_slice = img[:, idx, :]
-            mask_slice = mask[:, idx, :]
+            rgb_slice = rgb[:, :, idx].swapaxes(0, 1)
         else: # Axial (Default)
-            img_slice = img[:, :, idx]
-            mask_slice = mask[:, :, idx]
+            rgb_slice = rgb[idx]
 
         # 5. Rotate for correct viewing orientation
-        img_slice = np.rot90(img_slice)
-        mask_slice = np.rot90(mask_slice)
-
-        # 6. Normalize and Colorize
-        max_val = np.max(img_slice)
-        img_norm = img_slice / (max_val + 1e-6)
-        
-        # Create base Grayscale image (R=G=B) + Alpha
-        rgba = np.stack([img_norm] * 3 + [np.ones_like(img_norm)], axis=-1) * 255
-        
-        # Overlay Colors: Red (1), Blue (2), Yellow (3)
-        colors = {1: [239, 68, 68], 2: [59, 130, 246], 3: [251, 191, 36]}
-        
-        for label_id, color in colors.items():
-            mask_region = (mask_slice == label_id)
-            if np.any(mask_region):
-                # Blend: 60% Color + 40% Original Pixel
-                for ch in range(3): 
-                    rgba[mask_region, ch] = rgba[mask_region, ch] * 0.4 + np.array(color)[ch] * 0.6
-
-        # 7. Create Figure
-        fig = go.Figure(go.Image(z=rgba.astype(np.uint8)))
-        fig.update_layout(
-            margin=dict(l=0, r=0, b=0, t=0), 
-            xaxis=dict(visible=False), 
-            yaxis=dict(visible=False), 
-            paper_bgcolor='rgba(0,0,0,0)', 
-            plot_bgcolor='rgba(0,0,0,0)',
-            hovermode=False
-        )
-        return fig
+        return np.rot90(rgb_slice)
 
     except Exception as e:
         print(f"❌ SLICE ERROR: {e}")
-        return go.Figure(layout=dict(paper_bgcolor="rgba(0,0,0,0)"))
+        return None
 
-# --- UPDATED CALLBACKS USING THE NEW FUNCTION ---
+def get_slice_fig(path, dim, idx):
+    """Partial update for a slice view's figure: only the image trace is sent, the layout
+    (SLICE_FIGURE) stays as it is in the browser"""
+    rgb_slice = get_slice(path, dim, idx)
+    patch = Patch()
+    if rgb_slice is None:
+        patch["data"] = []
+    else:
+        # Same typed-array form plotly uses in full figures: base64 bytes, not nested lists
+        rgb_slice = np.ascontiguousarray(rgb_slice)
+        patch["data"] = [{"type": "image", "z": {
+            "dtype": "u1", "bdata": binascii.b2a_base64(rgb_slice, newline=False).decode("ascii"),
+            "shape": ", ".join(map(str, rgb_slice.shape))}}]
+    return patch
 
-@app.callback([Output("2d-axial", "figure"), Output("slice-indicator-axial", "children")],
-              [Input("slice-slider-axial", "value")], State("results", "data"), prevent_initial_call=True)
-def update_axial_slice(idx, path):
-    return get_slice_fig(path, 2, idx), f"Slice {idx}"
+# --- UPDATED CALLBACKS USING THE NEW FUNCTION ---
 
-@app.callback([Output("2d-sagittal", "figure"), Output("slice-indicator-sagittal", "children")],
-              [Input("slice-slider-sagittal", "value")], State("results", "data"), prevent_initial_call=True)
-def update_sagittal_slice(idx, path):
-    return get_slice_fig(path, 0, idx), f"Slice {idx}"
+SLICE_DIMS = {"sagittal": 0, "coronal": 1, "axial": 2}
 
-@app.callback([Output("2d-coronal", "figure"), Output("slice-indicator-coronal", "children")],
-              [Input("slice-slider-coronal", "value")], State("results", "data"), prevent_initial_call=True)
-def update_coronal_slice(idx, path):
-    return get_slice_fig(path, 1, idx), f"Slice {idx}"
+# One callback for all three views: MATCH pairs each slider with its own graph and label
+@app.callback([Output({"type": "slice-view", "axis": MATCH}, "figure"),
+               Output({"type": "slice-indicator", "axis": MATCH}, "children")],
+              Input({"type": "slice-slider", "axis": MATCH}, "value"), State("results", "data"), prevent_initial_call=True)
+def update_slice(idx, path):
+    return get_slice_fig(path, SLICE_DIMS[ctx.triggered_id["axis"]], idx), f"Slice {idx}"
 
 # DOWNLOAD
-@app.callback(Output("dl-nifti", "data"), Input("btn-dl", "n_clicks"), State("results", "data"), prevent_initial_call=True)
-def download_mask(n, path):
-    if n and path: return dcc.send_file(os.path.join(path, "pred.nii.gz"))
-    raise PreventUpdate
+@app.callback([Output("dl-link", "href"), Output("dl-link", "aria-disabled")], Input("results", "data"))
+def update_download_link(path):
+    if not path:
+        return None, "true"
+    return f"/download/{os.path.basename(path)}", "false"
+
+@server.route("/download/<session_id>")
+def download_mask(session_id):
+    # Streamed from disk with range support, so large masks don't pass through memory and
+    # interrupted downloads can resume; send_from_directory keeps the path inside TEMP_DIR
+    wait_for_results(session_id)
+    return send_from_directory(TEMP_DIR, os.path.join(session_id, "pred.nii.gz"),
+                               as_attachment=True, conditional=True)
 
 # RUN APP
 if __name__ == "__main__":